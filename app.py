@@ -1,93 +1,85 @@
 import streamlit as st
-import pickle
-import pandas as pd
-import requests
+import html
 import logging
 
-movie_list = pickle.load(open('movie_dict.pkl', 'rb'))
-movies = pd.DataFrame(movie_list)
-similarity = pickle.load(open('similarity.pkl', 'rb'))
+from recommender import TITLES, poster_srcset, poster_url, prefetch, recommend
 
 logging.basicConfig(level=logging.INFO)
 
-def fetch_poster(movie_id, fallback_text="No+Image"):
+# In the default centered layout (~704px of content) each of the five columns is
+# about 128px wide; below 640px Streamlit stacks them at the full width.
+POSTER_SIZES_ATTR = "(max-width: 640px) 100vw, 130px"
+
+
+def prefetch_posters():
+    """
+    Warms the poster cache as soon as the selection changes.
+
+    Runs as the selectbox's ``on_change`` callback, so by the time the user
+    presses Recommend the posters are usually already there.
     """
-    Fetches the movie poster URL from TMDb API.
+    prefetch(st.session_state.movie_selected)
+
+
+def poster_html(title, poster_path):
+    """
+    Renders a poster as a responsive ``<img>`` so the browser picks the size it needs.
+
+    The image is decoded off the main thread, and its 2:3 box is reserved up
+    front so the columns do not reflow as posters arrive.
 
     Args:
-        movie_id (int or str): The TMDb movie ID.
-        fallback_text (str): Text to show on fallback image if poster not found.
+        title (str): Movie title, used as the alt text.
+        poster_path (str or None): The TMDb poster path.
 
     Returns:
-        str: URL of the poster image or a fallback placeholder.
+        str: The ``<img>`` tag.
     """
-    base_url = "https://api.themoviedb.org/3/movie"
-    image_base_url = "https://image.tmdb.org/t/p/w500/"
-    placeholder_url = f"https://via.placeholder.com/500x750.png?text={fallback_text}"
-
-    try:
-        url = f"{base_url}/{movie_id}?api_key=b76bb27542ba7b7652281b79d2905180&language=en-US"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
-        poster_path = data.get('poster_path')
-
-        if poster_path:
-            return image_base_url + poster_path
-        else:
-            logging.warning(f"No poster found for movie ID: {movie_id}")
-            return placeholder_url
-
-    except requests.RequestException as e:
-        logging.error(f"Request error for movie ID {movie_id}: {e}")
-    except ValueError as e:
-        logging.error(f"JSON decoding error for movie ID {movie_id}: {e}")
-    except Exception as e:
-        logging.error(f"Unexpected error for movie ID {movie_id}: {e}")
-
-    return f"https://via.placeholder.com/500x750.png?text=Error"
-
-
-def recommend_movies(movie_selected):
-    movie_index = movies[movies['title'] == movie_selected].index[0]
-    distance = similarity[movie_index]
-    movies_list = sorted(list(enumerate(distance)), reverse = True, key = lambda x : x[1])[1:6]
-    recommended_movies = []
-    movie_poster = [] 
-    for i in movies_list:
-        movie_id = movies.iloc[i[0]].id
-        movie_poster.append(fetch_poster(movie_id))
-        recommended_movies.append(movies.iloc[i[0]].title)
-    return recommended_movies, movie_poster
+    return (
+        f'<img src="{html.escape(poster_url(poster_path))}" '
+        f'srcset="{html.escape(poster_srcset(poster_path))}" sizes="{POSTER_SIZES_ATTR}" '
+        f'alt="{html.escape(title)}" decoding="async" style="width: 100%; aspect-ratio: 2 / 3">'
+    )
 
 
 st.title('Movie Baba')
 
 movie_selected = st.selectbox(
     "Select your recently watched movie",
-    movies['title'].values
+    TITLES,
+    key='movie_selected',
+    on_change=prefetch_posters
 )
 
 if st.button('Recommend'):
-    recommendations, poster = recommend_movies(movie_selected)
+    recommendations, poster = recommend(movie_selected)
+
+    # Let the browser start downloading the posters while the columns render.
+    st.markdown(
+        "".join(
+            f'<link rel="preload" as="image" href="{html.escape(poster_url(path))}" '
+            f'imagesrcset="{html.escape(poster_srcset(path))}" imagesizes="{POSTER_SIZES_ATTR}">'
+            for path in poster
+        ),
+        unsafe_allow_html=True
+    )
 
     col1, col2, col3, col4, col5 = st.columns(5)
 
     with col1:
         st.text(recommendations[0])
-        st.image(poster[0])
+        st.markdown(poster_html(recommendations[0], poster[0]), unsafe_allow_html=True)
     with col2:
         st.text(recommendations[1])
-        st.image(poster[1])
+        st.markdown(poster_html(recommendations[1], poster[1]), unsafe_allow_html=True)
     with col3:
         st.text(recommendations[2])
-        st.image(poster[2])
+        st.markdown(poster_html(recommendations[2], poster[2]), unsafe_allow_html=True)
     with col4:
         st.text(recommendations[3])
-        st.image(poster[3])
+        st.markdown(poster_html(recommendations[3], poster[3]), unsafe_allow_html=True)
     with col5:
         st.text(recommendations[4])
-        st.image(poster[4])
+        st.markdown(poster_html(recommendations[4], poster[4]), unsafe_allow_html=True)
 
 
@@ -0,0 +1,481 @@
+"""
+Movie lookups, neighbour ranking and TMDb poster fetching for the Movie Baba app.
+
+Imported once per process, so the Streamlit script in ``app.py`` only holds
+the UI and every rerun goes through the same cached loaders and TMDb client.
+
+Process-wide resources (the data, the TMDb client, the disk cache, the
+prefetch pool) are still created through ``st.cache_resource`` rather than as
+module globals. Streamlit re-imports a module whose source changed, and the
+cached objects survive that re-import.
+"""
+import streamlit as st
+import pickle
+import numpy as np
+import aiohttp
+import diskcache
+import orjson
+import asyncio
+import functools
+import random
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import logging
+
+@st.cache_resource
+def load_movies():
+    """
+    Loads the movie table as the lookups used on every click, once per process.
+
+    ``movie_dict.pkl`` holds ``DataFrame.to_dict()`` output, i.e. one
+    ``{row: value}`` dict per column in row order, so the columns are read
+    straight into numpy arrays without building a DataFrame.
+
+    Returns:
+        tuple: A title -> row index dict (first row wins for duplicate titles),
+        and the ``id`` and ``title`` columns as numpy arrays.
+    """
+    with open('movie_dict.pkl', 'rb') as f:
+        movie_list = pickle.load(f)
+    ids = np.asarray(list(movie_list['id'].values()), dtype=np.int64)
+    titles = np.asarray(list(movie_list['title'].values()), dtype=object)
+    title_index = {}
+    for i, title in enumerate(titles):
+        title_index.setdefault(title, i)
+    return title_index, ids, titles
+
+
+@st.cache_resource
+def load_similarity():
+    """
+    Loads the cosine-similarity matrix written by the notebook, once per process.
+
+    The matrix is memory-mapped so only the rows we actually read are paged in.
+
+    Returns:
+        numpy.ndarray: The C-contiguous ``(movies, movies)`` similarity matrix.
+    """
+    similarity = np.load('similarity.npy', mmap_mode='r')
+    if not similarity.flags['C_CONTIGUOUS'] or not np.issubdtype(similarity.dtype, np.floating):
+        # A Fortran-ordered or non-float matrix would turn every row read into
+        # a strided copy or a slow comparison, so pay for one conversion here.
+        similarity = np.ascontiguousarray(similarity, dtype=np.float32)
+    return similarity
+
+
+TITLE_INDEX, IDS, TITLES = load_movies()
+similarity = load_similarity()
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Budget for one lookup. The worst case is every attempt hitting the request
+# timeout plus all the retry sleep, and it must stay under LOOKUP_TIMEOUT:
+#     (MAX_RETRIES + 1) * REQUEST_TIMEOUT + MAX_RETRY_SLEEP < LOOKUP_TIMEOUT
+#     (2 + 1) * 3 + 3 = 12 < 15
+# so a throttled or slow movie still gets an answer before the click gives up.
+REQUEST_TIMEOUT = 3
+MAX_RETRIES = 2
+BACKOFF_FACTOR = 0.5
+BACKOFF_JITTER = 0.5
+# Total sleep across one lookup's retries, Retry-After included.
+MAX_RETRY_SLEEP = 3
+# How long a rerun waits for its poster lookups before showing placeholders.
+# Lookups still running carry on in the background and land in the disk cache.
+LOOKUP_TIMEOUT = 15
+# Room for more than one click's five lookups (and their retries) at once.
+MAX_CONNECTIONS = 16
+# Clicks are seconds apart; keep idle connections longer than aiohttp's 15s
+# default so the next click can skip the TLS handshake.
+KEEPALIVE_TIMEOUT = 60
+POSTER_CACHE_DIR = 'poster_cache'
+POSTER_CACHE_EXPIRE = 30*24*60*60
+# TMDb poster sizes offered to the browser, with their pixel widths. A ~130px
+# column takes w185 at 1x, w342 at 2x and w500 at 3x; w342 is the plain src.
+POSTER_SIZES = {'w185': 185, 'w342': 342, 'w500': 500}
+
+
+async def open_session():
+    """
+    Opens the pooled aiohttp session; must run on the loop that will use it.
+
+    Returns:
+        aiohttp.ClientSession: The session.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONNECTIONS, keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=300
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+
+def run_loop(loop):
+    """
+    Body of a client's loop thread: runs ``loop`` until it is stopped, then closes it.
+    """
+    loop.run_forever()
+    loop.close()
+
+
+def close_client(loop, session):
+    """
+    Closes a released client's session, then stops its event loop thread.
+
+    Args:
+        loop (asyncio.AbstractEventLoop): The client's running loop.
+        session (aiohttp.ClientSession): The session opened on ``loop``.
+    """
+    future = asyncio.run_coroutine_threadsafe(session.close(), loop)
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(loop.stop))
+
+
+class TmdbClient:
+    """
+    The event loop, aiohttp session and in-flight lookup map used for TMDb.
+
+    An aiohttp session is bound to the loop it was created on, so the loop runs
+    forever in a daemon thread and every rerun submits its requests to it. This
+    keeps TCP/TLS connections pooled across clicks and sessions. The three are
+    created and released together: once the client is dropped (e.g. when
+    ``st.cache_resource`` is cleared) the session is closed and the loop thread
+    exits, so a new client never shares lookups with an old loop.
+
+    Attributes:
+        loop (asyncio.AbstractEventLoop): The loop all TMDb requests run on.
+        session (aiohttp.ClientSession): The shared session.
+        in_flight (dict): ``asyncio.Task`` per TMDb movie ID for lookups still
+            running. Only touched from the loop thread, so it needs no lock.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=run_loop, args=(self.loop,), name='tmdb', daemon=True).start()
+        self.session = asyncio.run_coroutine_threadsafe(open_session(), self.loop).result()
+        self.in_flight = {}
+        # Not at exit: the daemon loop thread may already be gone by then.
+        weakref.finalize(self, close_client, self.loop, self.session).atexit = False
+
+
+@st.cache_resource
+def tmdb_client():
+    """
+    Returns the process-wide ``TmdbClient``.
+    """
+    return TmdbClient()
+
+
+@st.cache_resource
+def poster_cache():
+    """
+    Opens the on-disk poster path cache, which survives app restarts.
+
+    Returns:
+        diskcache.Cache: Poster paths keyed by TMDb movie ID.
+    """
+    return diskcache.Cache(POSTER_CACHE_DIR)
+
+
+def backoff_delay(attempt):
+    """
+    Returns how long to wait before retry number ``attempt`` (0-based).
+
+    The exponential delay gets up to ``BACKOFF_JITTER`` seconds of random
+    jitter, so clients that failed together do not all retry in lockstep.
+    """
+    return BACKOFF_FACTOR * 2 ** attempt + random.uniform(0, BACKOFF_JITTER)
+
+
+async def get_json(session, url):
+    """
+    GETs ``url`` and decodes the JSON body, retrying transient failures.
+
+    Connection errors, timeouts and the statuses in ``RETRY_STATUSES`` are
+    retried up to ``MAX_RETRIES`` times with jittered exponential backoff,
+    honouring a numeric ``Retry-After`` header when TMDb sends one. The sleeps
+    together never exceed ``MAX_RETRY_SLEEP``.
+
+    Args:
+        session (aiohttp.ClientSession): Session the request is issued on.
+        url (str): URL to fetch.
+
+    Returns:
+        dict: The decoded response body.
+    """
+    slept = 0
+    for attempt in range(MAX_RETRIES + 1):
+        # Once the sleep budget is spent, this attempt's answer is final.
+        last_attempt = attempt == MAX_RETRIES or slept >= MAX_RETRY_SLEEP
+        try:
+            async with session.get(url) as response:
+                if response.status not in RETRY_STATUSES or last_attempt:
+                    response.raise_for_status()
+                    return orjson.loads(await response.read())
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else backoff_delay(attempt)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if last_attempt:
+                raise
+            delay = backoff_delay(attempt)
+        delay = min(delay, MAX_RETRY_SLEEP - slept)
+        slept += delay
+        await asyncio.sleep(delay)
+
+
+async def fetch_poster_path(session, movie_id):
+    """
+    Fetches the movie's poster path from TMDb API.
+
+    Only the path is returned, not a full image URL, so cached lookups stay
+    valid whatever image size the page asks for. Answers from TMDb, including
+    "no poster", are written to ``poster_cache`` (read by ``fetch_poster_paths``
+    before anything reaches the loop). The SQLite write runs in the loop's
+    executor so a slow or locked disk cannot stall other lookups. Failed
+    lookups are not stored, so they are retried on the next call.
+
+    Args:
+        session (aiohttp.ClientSession): Session the request is issued on.
+        movie_id (int or str): The TMDb movie ID.
+
+    Returns:
+        str or None: The poster path, ``""`` if TMDb has no poster for the
+        movie (or answered with a 4xx other than 429), or ``None`` if the
+        lookup failed in a way worth retrying.
+    """
+    base_url = "https://api.themoviedb.org/3/movie"
+
+    try:
+        url = f"{base_url}/{movie_id}?api_key=b76bb27542ba7b7652281b79d2905180&language=en-US"
+        data = await get_json(session, url)
+        poster_path = data.get('poster_path') or ""
+
+        if not poster_path:
+            logging.warning(f"No poster found for movie ID: {movie_id}")
+
+    except aiohttp.ClientResponseError as e:
+        if e.status == 429 or e.status >= 500:
+            logging.error(f"Request error for movie ID {movie_id}: {e}")
+            return None
+        # Any other 4xx (e.g. 404 for a movie TMDb dropped) will not change on
+        # retry, so it is a definitive "no poster".
+        logging.warning(f"TMDb answered {e.status} for movie ID {movie_id}; no poster")
+        poster_path = ""
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.error(f"Request error for movie ID {movie_id}: {e}")
+        return None
+    except ValueError as e:
+        logging.error(f"JSON decoding error for movie ID {movie_id}: {e}")
+        return None
+    except Exception as e:
+        logging.error(f"Unexpected error for movie ID {movie_id}: {e}")
+        return None
+
+    try:
+        store = functools.partial(poster_cache().set, movie_id, poster_path, expire=POSTER_CACHE_EXPIRE)
+        await asyncio.get_running_loop().run_in_executor(None, store)
+    except Exception as e:
+        logging.error(f"Could not cache poster path for movie ID {movie_id}: {e}")
+    return poster_path
+
+
+def poster_url(poster_path, fallback_text="No+Image", size='w342'):
+    """
+    Builds the image URL for a path returned by ``fetch_poster_path``.
+
+    Args:
+        poster_path (str or None): The TMDb poster path.
+        fallback_text (str): Text to show on fallback image if poster not found.
+        size (str): One of the ``POSTER_SIZES`` keys.
+
+    Returns:
+        str: URL of the poster image or a fallback placeholder.
+    """
+    image_base_url = f"https://image.tmdb.org/t/p/{size}"
+
+    if poster_path:
+        return image_base_url + poster_path
+    if poster_path is None:
+        fallback_text = "Error"
+    return f"https://via.placeholder.com/500x750.png?text={fallback_text}"
+
+
+def poster_srcset(poster_path):
+    """
+    Builds an ``<img srcset>`` value covering every size in ``POSTER_SIZES``.
+
+    Args:
+        poster_path (str or None): The TMDb poster path.
+
+    Returns:
+        str: The srcset, or ``""`` when only a placeholder is available.
+    """
+    if not poster_path:
+        return ""
+    return ", ".join(f"{poster_url(poster_path, size=size)} {width}w" for size, width in POSTER_SIZES.items())
+
+
+def shared_lookup(client, movie_id):
+    """
+    Returns the running lookup for ``movie_id``, starting one if there is none.
+
+    Concurrent clicks that need the same movie await a single TMDb request
+    instead of each issuing their own. Must be called on the event loop.
+
+    Args:
+        client (TmdbClient): Client whose loop this is called on.
+        movie_id (int): The TMDb movie ID.
+
+    Returns:
+        asyncio.Task: Resolves to the result of ``fetch_poster_path``.
+    """
+    in_flight = client.in_flight
+    task = in_flight.get(movie_id)
+    if task is None:
+        task = asyncio.ensure_future(fetch_poster_path(client.session, movie_id))
+        in_flight[movie_id] = task
+        task.add_done_callback(lambda _: in_flight.pop(movie_id, None))
+    return task
+
+
+async def fetch_all(client, movie_ids):
+    """
+    Fetches the poster paths for several movies concurrently.
+
+    Args:
+        client (TmdbClient): Client whose loop this runs on.
+        movie_ids (list): TMDb movie IDs.
+
+    Each lookup gets ``LOOKUP_TIMEOUT``. Lookups still running then are not
+    cancelled, since other callers may share them through the in-flight map;
+    they finish in the background and fill the disk cache.
+
+    Returns:
+        list: Poster paths, in the same order as ``movie_ids``, with ``None``
+        for lookups that failed or are still running.
+    """
+    tasks = [shared_lookup(client, movie_id) for movie_id in movie_ids]
+    _, pending = await asyncio.wait(set(tasks), timeout=LOOKUP_TIMEOUT)
+    if pending:
+        logging.error(f"Poster lookups timed out after {LOOKUP_TIMEOUT}s for {len(pending)} of movie IDs {movie_ids}")
+    return [None if task in pending or task.cancelled() else task.result() for task in tasks]
+
+
+class PosterLookupError(Exception):
+    """
+    Raised by ``fetch_poster_paths`` when some lookup failed.
+
+    ``st.cache_data`` does not store exceptions, so raising keeps a failed
+    lookup out of the cache and the next call tries TMDb again.
+
+    Attributes:
+        poster_paths (list): The partial result, ``None`` where a lookup failed.
+    """
+
+    def __init__(self, poster_paths):
+        super().__init__("TMDb poster lookup failed")
+        self.poster_paths = poster_paths
+
+
+@st.cache_data(ttl=24*60*60, show_spinner=False)
+def fetch_poster_paths(movie_ids):
+    """
+    Returns the poster paths for ``movie_ids``, reusing results across reruns and sessions.
+
+    Only complete results are cached; see ``PosterLookupError``.
+
+    Args:
+        movie_ids (tuple): TMDb movie IDs as plain ints so they hash stably.
+
+    Returns:
+        list: Poster paths, in the same order as ``movie_ids``.
+
+    Raises:
+        PosterLookupError: If any lookup failed or took longer than
+            ``LOOKUP_TIMEOUT``.
+    """
+    # Disk cache reads happen here, on the caller's thread; only misses go to
+    # the shared event loop.
+    cache = poster_cache()
+    poster_paths = [cache.get(movie_id) for movie_id in movie_ids]
+    misses = [movie_id for movie_id, path in zip(movie_ids, poster_paths) if path is None]
+
+    if misses:
+        client = tmdb_client()
+        future = asyncio.run_coroutine_threadsafe(fetch_all(client, misses), client.loop)
+        try:
+            # fetch_all returns after LOOKUP_TIMEOUT by itself; this only guards
+            # against a wedged loop.
+            fetched = future.result(timeout=LOOKUP_TIMEOUT + 5)
+        except FutureTimeoutError:
+            logging.error(f"TMDb event loop did not answer for movie IDs {misses}")
+            fetched = [None] * len(misses)
+        fetched = iter(fetched)
+        poster_paths = [next(fetched) if path is None else path for path in poster_paths]
+
+    if None in poster_paths:
+        raise PosterLookupError(poster_paths)
+    return poster_paths
+
+
+@st.cache_resource
+def prefetch_pool():
+    """
+    Returns the thread pool that warms the poster cache in the background.
+    """
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix='prefetch')
+
+
+def closest_movies(movie_selected):
+    """
+    Finds the five movies most similar to ``movie_selected``.
+
+    Args:
+        movie_selected (str): Title of the movie the user picked.
+
+    Returns:
+        numpy.ndarray: Row indices of the five neighbours, most similar first;
+        equal scores keep row order.
+    """
+    movie_index = TITLE_INDEX[movie_selected]
+    # Widen the stored float16 row so the partition runs on native float32. This
+    # is always a copy, so the shared matrix is never written to below.
+    distances = np.array(similarity[movie_index], dtype=np.float32)
+    # float16 can round a close neighbour up to 1.0, so drop the movie itself by
+    # index rather than assuming it sorts first.
+    distances[movie_index] = -np.inf
+    # Partition for the fifth-best score instead of sorting the whole row, then
+    # stably order everything at or above it. Ties keep row order, as the old
+    # full sorted() did.
+    fifth_best = np.partition(distances, -5)[-5]
+    closest = np.flatnonzero(distances >= fifth_best)
+    return closest[np.argsort(-distances[closest], kind='stable')][:5]
+
+
+def prefetch(movie_selected):
+    """
+    Starts fetching the posters for ``movie_selected``'s recommendations.
+
+    The lookup runs in the background and lands in the ``fetch_poster_paths``
+    cache, so a following ``recommend`` call usually finds the posters there.
+    """
+    movie_ids = tuple(IDS[closest_movies(movie_selected)].tolist())
+    prefetch_pool().submit(fetch_poster_paths, movie_ids)
+
+
+def recommend(movie_selected):
+    """
+    Recommends five movies similar to ``movie_selected``.
+
+    Args:
+        movie_selected (str): Title of the movie the user picked.
+
+    Returns:
+        tuple: The recommended titles and their poster paths (see
+        ``poster_url`` and ``poster_srcset``), most similar first.
+    """
+    movies_list = closest_movies(movie_selected)
+    recommended_movies = TITLES[movies_list].tolist()
+    movie_ids = tuple(IDS[movies_list].tolist())
+    try:
+        poster_paths = fetch_poster_paths(movie_ids)
+    except PosterLookupError as e:
+        # Show what did load; the failed lookups are retried on the next click.
+        poster_paths = e.poster_paths
+    return recommended_movies, poster_paths